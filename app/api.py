@@ -9,12 +9,17 @@ api.py - Blender手冊RAG系統的API服務
 
 from typing import Literal
 from contextlib import asynccontextmanager
+from collections import OrderedDict
+from functools import lru_cache
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import opencc
 import asyncio
 import logging
+import threading
+import os
 
 from scripts import model_embedding
 from scripts import model_faiss
@@ -25,6 +30,35 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 converter = opencc.OpenCC("s2t.json")  # 簡轉繁
 tag: Literal["idle", "loading", "error", "ok"] = "idle"  # 服務狀態標誌
+THREAD_POOL_SIZE = int(os.environ.get("THREAD_POOL_SIZE", "40"))  # 事件迴圈預設線程池上限
+
+
+# 查詢→完整回答的LRU快取：重複的問題直接重播答案，
+# 完全省去關鍵字生成、向量檢索與LLM推理
+ANSWER_CACHE_SIZE = 128
+_answer_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _cache_answer(question: str, answer: str):
+    """記錄完整回答，超出容量時淘汰最久未使用的項目"""
+    _answer_cache[question] = answer
+    _answer_cache.move_to_end(question)
+    while len(_answer_cache) > ANSWER_CACHE_SIZE:
+        _answer_cache.popitem(last=False)
+
+
+@lru_cache(maxsize=4096)
+def _s2t_cached(chunk: str) -> str:
+    """簡轉繁並轉義換行，快取重複出現的短字串"""
+    return converter.convert(chunk).replace("\n", "\\n")
+
+
+def s2t(chunk: str) -> str:
+    """簡轉繁，LLM流式輸出中大量重複的短片段可直接命中快取"""
+    # 過長的字串幾乎不會重複，直接轉換以免佔用快取
+    if len(chunk) >= 256:
+        return converter.convert(chunk).replace("\n", "\\n")
+    return _s2t_cached(chunk)
 
 
 def load_models_sync():
@@ -35,6 +69,7 @@ def load_models_sync():
         logger.info("正在載入向量嵌入模型與FAISS索引...")
         model_embedding.load_model()
         model_faiss.load_model()
+        model_faiss.warmup()
 
         logger.info("正在載入Ollama模型中...")
         next(query.process_query("你好"))
@@ -46,16 +81,15 @@ def load_models_sync():
         tag = "error"
 
 
-async def load_models():
-    """預載入模型和索引(異步)"""
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, load_models_sync)
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """在應用啟動時預載入模型和索引"""
-    asyncio.create_task(load_models())
+    # 以有上限的線程池取代預設的無界executor
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE))
+
+    # 在背景線程載入模型，讓啟動立即返回
+    asyncio.create_task(asyncio.to_thread(load_models_sync))
     logger.info("API服務啟動中...")
     yield
 
@@ -102,14 +136,90 @@ async def handle_query(question: str = Query(..., description="提問問題")):
     if not question or question.strip() == "":
         raise HTTPException(status_code=400, detail="查詢內容不能為空")
 
+    # 重複的問題直接從快取重播完整回答
+    cache_key = question.strip()
+    cached_answer = _answer_cache.get(cache_key)
+    if cached_answer is not None:
+        _answer_cache.move_to_end(cache_key)
+        logger.info(f"查詢命中快取: '{cache_key}'")
+
+        async def stream_cached():
+            yield f"data: {cached_answer}\n\n"
+
+        return StreamingResponse(stream_cached(), media_type="text/event-stream")
+
     # 處理查詢
     try:
         # 將每個文本塊轉換為SSE格式的事件
-        def stream_response():
-            for text_chunk in query.process_query(question):
-                safe_chunk = converter.convert(text_chunk).replace("\n", "\\n")
+        # 使用異步生成器，避免Starlette為每個同步yield切換線程池
+        async def stream_response():
+            queue: asyncio.Queue = asyncio.Queue(maxsize=32)
+            _end = object()  # 佇列結束標記
+            disconnected = threading.Event()  # 客戶端斷線時通知生產線程停止
+
+            def _put(item) -> bool:
+                """將項目送入佇列，消費端已斷線時放棄並返回False
+
+                以短逾時輪詢而非無限阻塞：客戶端斷線後沒有人會再取出項目，
+                佇列滿時無限阻塞的put會讓這條線程永遠佔住線程池。
+                """
+                while not disconnected.is_set():
+                    future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+                    try:
+                        future.result(timeout=1)
+                        return True
+                    except FuturesTimeoutError:
+                        # 取消失敗代表恰好在逾時後完成，視同送入成功
+                        if not future.cancel():
+                            return True
+                return False
+
+            def produce():
+                """在背景線程執行同步的查詢流程，將結果送入佇列"""
+                try:
+                    for text_chunk in query.process_query(question):
+                        if not _put(text_chunk):
+                            break
+                finally:
+                    _put(_end)
+
+            loop = asyncio.get_running_loop()
+            producer = asyncio.create_task(asyncio.to_thread(produce))
+
+            # 逐token轉換既浪費OpenCC的固定呼叫成本，也可能在字詞邊界轉錯，
+            # 改為累積到句子邊界（或緩衝過長）才整段轉換
+            buffer = ""
+            safe_parts = []
+            try:
+                while True:
+                    text_chunk = await queue.get()
+                    if text_chunk is _end:
+                        break
+
+                    buffer += text_chunk
+                    if len(buffer) >= 64 or buffer.endswith(("。", "！", "？", "\n")):
+                        safe_chunk = s2t(buffer)
+                        buffer = ""
+                        safe_parts.append(safe_chunk)
+                        yield f"data: {safe_chunk}\n\n"
+            finally:
+                # 無論正常結束或客戶端斷線都先通知生產線程停止，
+                # 並清空佇列解除可能阻塞中的put，線程才能歸還給線程池
+                disconnected.set()
+                while not queue.empty():
+                    queue.get_nowait()
+                await producer
+
+            # 轉換並送出剩餘的緩衝內容
+            if buffer:
+                safe_chunk = s2t(buffer)
+                safe_parts.append(safe_chunk)
                 yield f"data: {safe_chunk}\n\n"
 
+            # 完整串流結束後才寫入快取；單一塊的回應多半是錯誤訊息，不快取
+            if len(safe_parts) > 1:
+                _cache_answer(cache_key, "".join(safe_parts))
+
         # 返回流式響應
         return StreamingResponse(stream_response(), media_type="text/event-stream")
     except Exception as e:
@@ -6,112 +6,130 @@ clean.py - 將Blender官方手冊HTML轉換成純文字
 
 此腳本讀取data/html資料夾中的HTML檔案，
 先提取 <main> 標籤內容以去除導航欄等不必要內容，
-然後使用markdownify清理HTML標籤，
+然後使用selectolax(lexbor的C解析器)抽取純文字，
 並將純文字保存到data/texts資料夾。
+透過來源內容的雜湊清單支援增量建置，未變更的檔案直接跳過。
 """
 
 import os
+import json
 import time
-import shutil
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from markdownify import markdownify as md
-from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+from selectolax.lexbor import LexborHTMLParser
+import xxhash
 
 # 設定資料路徑
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 HTML_DIR = DATA_DIR / "html"
 TEXT_DIR = DATA_DIR / "texts"
+MANIFEST_PATH = DATA_DIR / "clean_manifest.json"
 
-# markdownify 設定選項
-MD_OPTIONS = {
-    'strip': ['a'],
-    'heading_style': 'ATX',
-    'bullets': '-',
-    'autolinks': False,
-    'code_language': '',
-    'beautiful_soup_parser': 'lxml'
-}
+# 抽取文字時完全移除的標籤（內容對檢索沒有幫助）
+STRIP_TAGS = ["script", "style"]
 
 def ensure_directories():
     """確保所需的資料夾存在"""
     print("確保資料夾結構存在...")
     DATA_DIR.mkdir(exist_ok=True)
-
-    # 如果文字目錄已存在，先清空它
-    if TEXT_DIR.exists():
-        print("清空現有的文字資料夾...")
-        shutil.rmtree(TEXT_DIR)
-
     TEXT_DIR.mkdir(exist_ok=True)
 
-def extract_main_content(html_content):
-    """從HTML中提取<main>標籤內容"""
+def load_manifest():
+    """載入上次轉換的來源雜湊清單，清單不存在或損壞時視為全新建置"""
+    if not MANIFEST_PATH.exists():
+        return {}
+
     try:
-        soup = BeautifulSoup(html_content, 'lxml')
-        main_tag = soup.find('main')
-
-        # 如果找到main標籤，返回其HTML內容
-        if main_tag:
-            return str(main_tag)
-        # 如果沒有找到main標籤，嘗試查找article或section標籤
-        else:
-            article_tag = soup.find('article')
-            if article_tag:
-                return str(article_tag)
-
-            section_tag = soup.find('section', {'id': 'content'})
-            if section_tag:
-                return str(section_tag)
-
-            # 如果都找不到，返回整個body內容
-            body_tag = soup.find('body')
-            if body_tag:
-                return str(body_tag)
-
-            # 最後的後備方案是返回原始HTML
-            return html_content
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
     except Exception as e:
-        print(f"提取main內容時發生錯誤: {e}")
-        return html_content  # 出錯時返回原始HTML
+        print(f"讀取雜湊清單時發生錯誤，將重新處理所有檔案: {e}")
+        return {}
 
-def html_to_text(html_file):
-    """將單個HTML檔案轉換為純文字"""
+def save_manifest(manifest):
+    """保存本次轉換的來源雜湊清單"""
     try:
-        # 計算目標路徑
-        rel_path = html_file.relative_to(HTML_DIR)
-        target_path = TEXT_DIR / rel_path.with_suffix('.txt')
+        with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+    except Exception as e:
+        print(f"保存雜湊清單時發生錯誤: {e}")
 
-        # 確保目標資料夾存在
-        target_path.parent.mkdir(exist_ok=True, parents=True)
+def extract_main_text(html_content):
+    """從HTML中提取<main>標籤的純文字內容"""
+    tree = LexborHTMLParser(html_content)
+    tree.strip_tags(STRIP_TAGS)
+
+    # 優先使用main標籤，依序後備到article、section#content與body
+    node = (
+        tree.css_first('main')
+        or tree.css_first('article')
+        or tree.css_first('section#content')
+        or tree.body
+    )
+
+    # 連body都沒有時（非完整HTML），直接從整棵樹抽取文字
+    if node is None:
+        return tree.root.text(separator='\n') if tree.root else html_content
+
+    return node.text(separator='\n')
+
+def html_to_text(task):
+    """將單個HTML檔案轉換為純文字，來源內容未變時直接跳過
+
+    Args:
+        task: (html檔案路徑, 上次轉換時的來源雜湊或None)
+
+    Returns:
+        tuple: (相對路徑, 來源雜湊, 狀態)，狀態為 "ok"、"skip" 或 "fail"
+    """
+    html_file, old_hash = task
+    rel_path = os.path.relpath(html_file, HTML_DIR)
+
+    try:
+        target_path = (TEXT_DIR / rel_path).with_suffix('.txt')
 
         # 讀取HTML
         with open(html_file, 'r', encoding='utf-8') as f:
             html_content = f.read()
 
-        # 先提取<main>內容
-        main_content = extract_main_content(html_content)
+        # 來源內容未變且輸出存在時，跳過轉換
+        src_hash = xxhash.xxh3_64_hexdigest(html_content)
+        if src_hash == old_hash and target_path.exists():
+            return rel_path, src_hash, "skip"
 
-        # 轉換為純文字
-        text_content = md(main_content, **MD_OPTIONS)
+        # 確保目標資料夾存在
+        target_path.parent.mkdir(exist_ok=True, parents=True)
+
+        # 提取<main>內容並轉換為純文字
+        text_content = extract_main_text(html_content)
 
         # 保存純文字
         with open(target_path, 'w', encoding='utf-8') as f:
             f.write(text_content)
 
-        return True
+        return rel_path, src_hash, "ok"
     except Exception as e:
         print(f"處理檔案 {html_file} 時發生錯誤: {e}")
-        return False
+        return rel_path, None, "fail"
+
+def _walk_files(directory, suffix):
+    """以os.scandir遞迴尋找指定副檔名的檔案
+
+    相比Path.rglob，省去為每個項目建立Path物件與額外stat呼叫的成本，
+    直接產出原始字串路徑。
+    """
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_files(entry.path, suffix)
+            elif entry.name.endswith(suffix):
+                yield entry.path
+
 
 def find_html_files(directory):
     """遞迴尋找所有HTML檔案"""
-    html_files = []
-    for path in directory.rglob('*.html'):
-        if path.is_file():
-            html_files.append(path)
-    return html_files
+    return list(_walk_files(str(directory), '.html'))
 
 def process_files():
     """處理所有HTML檔案轉換為純文字"""
@@ -120,25 +138,31 @@ def process_files():
     total_files = len(html_files)
     print(f"找到 {total_files} 個HTML檔案需要處理")
 
+    # 載入上次的雜湊清單，未變更的檔案可以跳過
+    manifest = load_manifest()
+    tasks = [(html_file, manifest.get(os.path.relpath(html_file, HTML_DIR))) for html_file in html_files]
+
     # 處理進度追蹤變數
     processed = 0
     success = 0
+    skipped = 0
     failed = 0
+    new_manifest = {}
     start_time = time.time()
     last_log_time = start_time  # 記錄上次輸出日誌的時間
 
-    # 使用多線程處理檔案
+    # 使用多進程處理檔案，chunksize讓每次行程間通訊批次傳遞多個任務
     with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
-        # 提交所有任務
-        future_to_file = {executor.submit(html_to_text, html_file): html_file for html_file in html_files}
-
-        # 處理完成的任務
-        for future in as_completed(future_to_file):
+        for rel_path, src_hash, status in executor.map(html_to_text, tasks, chunksize=16):
             processed += 1
-            if future.result():
-                success += 1
-            else:
+            if status == "fail":
                 failed += 1
+            else:
+                new_manifest[rel_path] = src_hash
+                if status == "skip":
+                    skipped += 1
+                else:
+                    success += 1
 
             # 計算進度和速度
             elapsed = time.time() - start_time
@@ -154,9 +178,19 @@ def process_files():
                 print(f"處理進度: {percent}% [{processed}/{total_files}] 速度: {files_per_sec:.1f} 檔案/秒, 預估剩餘時間: {int(remaining)}秒")
                 last_log_time = current_time
 
+    # 清除已從來源消失的舊輸出
+    for rel_path in set(manifest) - set(new_manifest):
+        stale_path = (TEXT_DIR / rel_path).with_suffix('.txt')
+        if stale_path.exists():
+            stale_path.unlink()
+
+    # 保存本次的雜湊清單供下次增量建置
+    save_manifest(new_manifest)
+
     # 處理完成
     print("處理完成")
     print(f"成功轉換: {success} 個檔案")
+    print(f"跳過未變更: {skipped} 個檔案")
     print(f"處理失敗: {failed} 個檔案")
     print(f"總處理時間: {time.time() - start_time:.2f} 秒")
 
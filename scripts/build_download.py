@@ -5,15 +5,18 @@
 download.py - 下載Blender官方手冊
 
 此腳本從Blender官方網站下載最新版本的手冊HTML壓縮檔，
-並解壓到data/html資料夾中供後續處理。
+在記憶體中直接解壓到data/html資料夾中供後續處理，
+不需將ZIP檔寫入磁碟再重新讀取。
 """
 
-import os
+import io
 import requests
 import zipfile
 import shutil
 import time
 from pathlib import Path
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # 官方手冊下載URL
 BLENDER_MANUAL_URL = "https://docs.blender.org/manual/en/latest/blender_manual_html.zip"
@@ -22,7 +25,9 @@ BLENDER_MANUAL_URL = "https://docs.blender.org/manual/en/latest/blender_manual_h
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 HTML_DIR = DATA_DIR / "html"
-DOWNLOAD_PATH = DATA_DIR / "blender_manual_html.zip"
+
+# 平行下載的HTTP連線數，多條連線以Range請求各抓一段以填滿頻寬
+N_CONNECTIONS = 8
 
 def ensure_directories():
     """確保所需的資料夾存在"""
@@ -36,10 +41,8 @@ def ensure_directories():
 
     HTML_DIR.mkdir(exist_ok=True)
 
-def download_manual():
-    """下載Blender官方手冊"""
-    print(f"開始從 {BLENDER_MANUAL_URL} 下載Blender手冊...")
-
+def _download_serial():
+    """以單一連線下載手冊（伺服器不支援Range請求時的後備方案）"""
     try:
         response = requests.get(BLENDER_MANUAL_URL, stream=True)
         response.raise_for_status()  # 檢查是否成功獲取
@@ -47,47 +50,112 @@ def download_manual():
         # 獲取文件大小以顯示下載進度
         total_size = int(response.headers.get('content-length', 0))
 
-        # 下載文件
-        with open(DOWNLOAD_PATH, 'wb') as f:
-            if total_size == 0:  # 無法獲取大小時的處理
-                f.write(response.content)
-                print("下載完成")
-            else:
-                downloaded = 0
-                last_log_time = time.time()  # 記錄上次輸出日誌的時間
-
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        percent = int(100 * downloaded / total_size)
-
-                        # 每10秒記錄新的一行進度，或者達到100%時
-                        current_time = time.time()
-                        if current_time - last_log_time >= 10 or percent >= 100:
-                            print(f"下載進度: {percent}% [{downloaded}/{total_size} bytes]")
-                            last_log_time = current_time
-
-                print("下載完成")
+        # 下載文件到記憶體緩衝區
+        buffer = io.BytesIO()
+        if total_size == 0:  # 無法獲取大小時的處理
+            buffer.write(response.content)
+            print("下載完成")
+        else:
+            downloaded = 0
+            last_log_time = time.time()  # 記錄上次輸出日誌的時間
+
+            for chunk in response.iter_content(chunk_size=8192):
+                if chunk:
+                    buffer.write(chunk)
+                    downloaded += len(chunk)
+                    percent = int(100 * downloaded / total_size)
+
+                    # 每10秒記錄新的一行進度，或者達到100%時
+                    current_time = time.time()
+                    if current_time - last_log_time >= 10 or percent >= 100:
+                        print(f"下載進度: {percent}% [{downloaded}/{total_size} bytes]")
+                        last_log_time = current_time
+
+            print("下載完成")
+
+        return buffer
+    except Exception as e:
+        print(f"下載過程中發生錯誤: {e}")
+        return None
+
 
-        return True
+def download_manual():
+    """下載Blender官方手冊到記憶體緩衝區，支援多連線平行下載
+
+    Returns:
+        io.BytesIO: 包含ZIP內容的緩衝區，下載失敗時返回None
+    """
+    print(f"開始從 {BLENDER_MANUAL_URL} 下載Blender手冊...")
+
+    # 先以HEAD請求確認檔案大小與Range支援
+    try:
+        head = requests.head(BLENDER_MANUAL_URL, allow_redirects=True)
+        head.raise_for_status()
+        total_size = int(head.headers.get('content-length', 0))
+        supports_range = head.headers.get('accept-ranges', '').lower() == 'bytes'
+    except Exception as e:
+        print(f"查詢檔案資訊時發生錯誤: {e}")
+        total_size, supports_range = 0, False
+
+    if total_size == 0 or not supports_range:
+        print("伺服器不支援Range請求，改用單一連線下載")
+        return _download_serial()
+
+    # 將檔案切成N段，每段一條連線以Range請求平行下載到同一塊緩衝區
+    try:
+        part_size = total_size // N_CONNECTIONS
+        ranges = [
+            (i * part_size, (i + 1) * part_size - 1 if i < N_CONNECTIONS - 1 else total_size - 1)
+            for i in range(N_CONNECTIONS)
+        ]
+
+        progress = {"downloaded": 0, "last_log": time.time()}
+        lock = Lock()
+        buffer = bytearray(total_size)  # 預先配置完整大小的緩衝區
+        view = memoryview(buffer)
+
+        def fetch_range(start, end):
+            """下載指定範圍並寫入緩衝區中對應的位置"""
+            headers = {'Range': f'bytes={start}-{end}'}
+            response = requests.get(BLENDER_MANUAL_URL, headers=headers, stream=True)
+            response.raise_for_status()
+
+            offset = start
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                if not chunk:
+                    continue
+                view[offset : offset + len(chunk)] = chunk
+                offset += len(chunk)
+
+                # 每10秒記錄新的一行進度
+                with lock:
+                    progress["downloaded"] += len(chunk)
+                    current_time = time.time()
+                    if current_time - progress["last_log"] >= 10:
+                        percent = int(100 * progress["downloaded"] / total_size)
+                        print(f"下載進度: {percent}% [{progress['downloaded']}/{total_size} bytes]")
+                        progress["last_log"] = current_time
+
+        with ThreadPoolExecutor(max_workers=N_CONNECTIONS) as executor:
+            futures = [executor.submit(fetch_range, start, end) for start, end in ranges]
+            for future in as_completed(futures):
+                future.result()
+
+        print("下載完成")
+        return io.BytesIO(buffer)
     except Exception as e:
         print(f"下載過程中發生錯誤: {e}")
-        return False
+        return None
 
-def extract_manual():
-    """解壓縮下載的手冊"""
-    print(f"解壓縮 {DOWNLOAD_PATH} 到 {HTML_DIR}...")
+def extract_manual(zip_buffer):
+    """直接從記憶體緩衝區解壓縮手冊，省去ZIP檔的磁碟寫入與重讀"""
+    print(f"解壓縮手冊到 {HTML_DIR}...")
 
     try:
-        with zipfile.ZipFile(DOWNLOAD_PATH, 'r') as zip_ref:
+        with zipfile.ZipFile(zip_buffer) as zip_ref:
             zip_ref.extractall(HTML_DIR)
         print("解壓縮完成")
 
-        # 解壓後刪除ZIP檔
-        os.remove(DOWNLOAD_PATH)
-        print(f"已刪除下載的ZIP檔 {DOWNLOAD_PATH}")
-
         return True
     except Exception as e:
         print(f"解壓縮過程中發生錯誤: {e}")
@@ -101,9 +169,10 @@ def main():
     ensure_directories()
 
     # 下載手冊
-    if download_manual():
+    zip_buffer = download_manual()
+    if zip_buffer is not None:
         # 解壓縮手冊
-        if extract_manual():
+        if extract_manual(zip_buffer):
             print("=== Blender官方手冊下載並解壓完成 ===")
             return True
 
@@ -12,6 +12,8 @@ validate.py - 驗證Blender手冊RAG系統的向量索引
 import time
 from pathlib import Path
 
+import numpy as np
+
 # 導入專用模型加載模塊
 from scripts import model_embedding
 from scripts import model_faiss
@@ -32,18 +34,22 @@ TEST_QUERIES = [
 ]
 
 
-def retrieve_relevant_texts(query: str):
-    """對查詢進行向量化，並查詢索引"""
+def retrieve_relevant_texts_batch(queries):
+    """一次對所有查詢進行向量化與索引搜尋
+
+    批次編碼攤平模型的前向計算成本，單次search呼叫讓FAISS
+    以平行方式處理所有查詢向量。
+    """
     try:
         start_time = time.time()
-        query_vector = model_embedding.encode_text([query])[0].astype("float32").reshape(1, -1)
-        results = model_faiss.query_index(query_vector)
+        query_matrix = np.asarray(model_embedding.encode_text(queries), dtype=np.float32)
+        all_results = model_faiss.query_index_batch(query_matrix)
 
         query_time = time.time() - start_time
-        return results, query_time
+        return all_results, query_time
     except Exception as e:
         print(f"查詢索引時發生錯誤: {e}")
-        return [], 0
+        return [[] for _ in queries], 0
 
 
 def validate_index():
@@ -62,27 +68,28 @@ def validate_index():
         print("無法載入FAISS索引或文本塊資料")
         return False
 
-    # 執行測試查詢
+    # 執行測試查詢（一次批量編碼與搜尋所有查詢）
     print(f"\n執行 {len(TEST_QUERIES)} 個測試查詢...")
     all_successful = True
-    total_time = 0
 
-    for i, query in enumerate(TEST_QUERIES):
-        print(f"\n測試查詢 {i + 1}/{len(TEST_QUERIES)}: '{query}'")
+    all_results, total_time = retrieve_relevant_texts_batch(TEST_QUERIES)
 
-        results, query_time = retrieve_relevant_texts(query)
-        total_time += query_time
+    for i, (query, results) in enumerate(zip(TEST_QUERIES, all_results)):
+        print(f"\n測試查詢 {i + 1}/{len(TEST_QUERIES)}: '{query}'")
 
         if not results:
             print("  ❌ 失敗：沒有找到相關結果")
             all_successful = False
             continue
 
-        print(f"  ✓ 成功：找到 {len(results)} 個結果，查詢時間: {query_time:.3f}秒")
+        print(f"  ✓ 成功：找到 {len(results)} 個結果")
 
-        # 顯示第一個結果的簡短預覽
+        # 顯示第一個結果的簡短預覽（內容採延遲讀取，需要時才開檔）
         if results:
-            content = results[0]["content"]
+            try:
+                content = model_faiss.read_text(results[0]["path"])
+            except OSError:
+                content = "(無法讀取內容)"
             preview = content[:150] + "..." if len(content) > 150 else content
             file = results[0]["file"]
             similarity = results[0]["similarity"]
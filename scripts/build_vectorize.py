@@ -12,12 +12,15 @@ vectorize.py - 為Blender官方手冊建立向量索引
 """
 
 import os
+import sys
+import mmap
 import shutil
-import json
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict
 
+import numpy as np
+
 # 導入專用模型加載模塊
 from scripts import model_embedding
 from scripts import model_faiss
@@ -32,6 +35,7 @@ INDEX_DIR = DATA_DIR / "index"
 CHUNK_SIZE = 500  # 每個分段的字符數
 CHUNK_OVERLAP = 50  # 分段間的重疊字符數
 MAX_CHUNKS_PER_FILE = 1000  # 每個檔案最多處理的分段數，防止極大檔案
+MMAP_THRESHOLD = 64 * 1024  # 超過此大小的檔案改用mmap讀取
 
 
 def ensure_directories():
@@ -47,9 +51,17 @@ def ensure_directories():
     INDEX_DIR.mkdir(exist_ok=True)
 
 
-def load_text_file(file_path: Path) -> str:
-    """載入純文字檔案內容"""
+def load_text_file(file_path: str) -> str:
+    """載入純文字檔案內容
+
+    較大的檔案以mmap讀取，省去核心緩衝區到使用者空間的額外複製；
+    小檔案維持普通讀取，避免mmap的建立成本。
+    """
     try:
+        if os.path.getsize(file_path) > MMAP_THRESHOLD:
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[:].decode("utf-8")
+
         with open(file_path, "r", encoding="utf-8") as f:
             return f.read()
     except Exception as e:
@@ -69,18 +81,30 @@ def chunk_text(text: str, file_path: str) -> List[Dict[str, str]]:
     file_path = str(file_path)
 
     # 將文本按段落分割
+    # 以列表收集段落、最後再join，避免重複串接字串造成O(n²)複製
     paragraphs = text.split("\n\n")
-    current_chunk = ""
+    current_parts: List[str] = []
+    current_len = 0
+
+    def flush_current():
+        """將目前累積的段落合併成一個塊"""
+        nonlocal current_len
+        if current_parts:
+            chunks.append({"content": "\n\n".join(current_parts).strip(), "source": file_path})
+            current_parts.clear()
+            current_len = 0
 
     for paragraph in paragraphs:
+        # 跳過開頭的空段落
+        if not paragraph and not current_parts:
+            continue
+
         # 如果段落太長，直接做為一個塊
         if len(paragraph) > CHUNK_SIZE:
             # 如果當前塊不為空，先添加當前塊
-            if current_chunk:
-                chunks.append({"content": current_chunk.strip(), "source": file_path})
-                current_chunk = ""
+            flush_current()
 
-            # 處理長段落
+            # 處理長段落，以固定步長切出重疊視窗
             for i in range(0, len(paragraph), CHUNK_SIZE - CHUNK_OVERLAP):
                 chunk = paragraph[i : i + CHUNK_SIZE]
                 if chunk:
@@ -91,39 +115,55 @@ def chunk_text(text: str, file_path: str) -> List[Dict[str, str]]:
                     return chunks
 
         # 如果加上新段落後長度超過限制，保存當前塊並創建新塊
-        elif len(current_chunk) + len(paragraph) + 2 > CHUNK_SIZE:  # +2 for '\n\n'
-            if current_chunk:
-                chunks.append({"content": current_chunk.strip(), "source": file_path})
-            current_chunk = paragraph
+        elif current_len + len(paragraph) + 2 > CHUNK_SIZE:  # +2 for '\n\n'
+            flush_current()
+            current_parts.append(paragraph)
+            current_len = len(paragraph)
 
         # 否則，將段落添加到當前塊
         else:
-            if current_chunk:
-                current_chunk += "\n\n" + paragraph
+            if current_parts:
+                current_len += 2 + len(paragraph)
             else:
-                current_chunk = paragraph
+                current_len = len(paragraph)
+            current_parts.append(paragraph)
 
     # 添加最後一個塊
-    if current_chunk:
-        chunks.append({"content": current_chunk.strip(), "source": file_path})
+    flush_current()
 
     return chunks
 
 
-def find_text_files(directory: Path) -> List[Path]:
+def _walk_files(directory: str, suffix: str):
+    """以os.scandir遞迴尋找指定副檔名的檔案
+
+    相比Path.rglob，省去為每個項目建立Path物件與額外stat呼叫的成本，
+    直接產出原始字串路徑。
+    """
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_files(entry.path, suffix)
+            elif entry.name.endswith(suffix):
+                yield entry.path
+
+
+def find_text_files(directory: Path) -> List[str]:
     """遞迴尋找所有文字檔案"""
-    return list(directory.rglob("*.txt"))
+    return list(_walk_files(str(directory), ".txt"))
 
 
-def process_file(text_file: Path) -> List[Dict[str, str]]:
+def process_file(text_file: str) -> List[Dict[str, str]]:
     """處理單個檔案的分段"""
     content = load_text_file(text_file)
     if not content:
         return []
 
     # 計算相對路徑作為來源標識
-    rel_path = text_file.relative_to(TEXT_DIR)
-    chunks = chunk_text(content, str(rel_path))
+    # intern確保同一路徑字串在記憶體中只存在一份，
+    # 不會因每個分段各存一份而在收集階段膨脹RAM
+    rel_path = sys.intern(os.path.relpath(text_file, TEXT_DIR))
+    chunks = chunk_text(content, rel_path)
     return chunks
 
 
@@ -134,10 +174,16 @@ def vectorize_text_chunks(chunks: List[Dict[str, str]]):
     # 確保索引目錄存在
     ensure_directories()
 
+    if not chunks:
+        print("錯誤: 沒有任何文本塊可供向量化")
+        return False
+
     # 向量化文本塊
+    # 交給build_embeddings一次處理：encode內部依長度排序分批，
+    # 每批只padding到該批的最長序列，比固定切批更省計算
     try:
         texts = [chunk["content"] for chunk in chunks]
-        embeddings = model_embedding.encode_text(texts)
+        embeddings = np.asarray(model_embedding.build_embeddings(texts), dtype=np.float32)
         print(f"成功向量化 {len(embeddings)} 個文本塊")
     except Exception as e:
         print(f"建立向量索引時發生錯誤: {e}")
@@ -147,9 +193,18 @@ def vectorize_text_chunks(chunks: List[Dict[str, str]]):
     model_faiss.create_index(embeddings)
 
     # 保存文本塊數據
-    print(f"保存文本塊數據到 {INDEX_DIR / 'chunks.json'}")
-    with open(INDEX_DIR / "chunks.json", "w", encoding="utf-8") as f:
-        json.dump(chunks, f, ensure_ascii=False, indent=2)
+    # 採用欄狀(SoA)格式：內容與來源各自一個陣列，
+    # 來源路徑大量重複，以字典編碼(唯一路徑表+索引)去重，
+    # 啟動時載入npz遠快於解析巨大的JSON
+    print(f"保存文本塊數據到 {INDEX_DIR / 'chunks.npz'}")
+    sources = [chunk["source"] for chunk in chunks]
+    source_table, source_ids = np.unique(np.array(sources, dtype=object), return_inverse=True)
+    np.savez_compressed(
+        INDEX_DIR / "chunks.npz",
+        content=np.array(texts, dtype=object),
+        source_id=source_ids.astype(np.int32),
+        source_table=source_table,
+    )
 
     print(f"索引創建完成，共包含 {len(chunks)} 個文本塊的向量")
     return True
@@ -176,23 +231,19 @@ def main():
     failed = 0
     all_chunks = []
 
-    # 使用多線程處理檔案
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        # 提交所有任務
-        future_to_file = {executor.submit(process_file, text_file): text_file for text_file in text_files}
-
-        # 處理完成的任務
-        for future in as_completed(future_to_file):
-            try:
-                file_chunks = future.result()
+    # 使用多進程處理檔案：讀檔與分段是純Python的CPU工作，
+    # 線程會被GIL序列化，chunksize讓每次行程間通訊批次傳遞多個任務
+    try:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for file_chunks in executor.map(process_file, text_files, chunksize=32):
                 if file_chunks:
                     all_chunks.extend(file_chunks)
                     success += 1
                 else:
                     failed += 1
-            except Exception as e:
-                print(f"\n處理檔案時發生錯誤: {e}")
-                failed += 1
+    except Exception as e:
+        print(f"\n處理檔案時發生錯誤: {e}")
+        return False
 
     print("分段處理完成")
     print(f"成功處理: {success} 個檔案")
@@ -5,17 +5,25 @@
 model_faiss.py - FAISS索引加載與管理模組
 
 此模組負責載入和初始化FAISS向量索引，
-提供GPU加速支援，同時管理索引和文本塊數據的載入與查詢功能。
+同時管理索引和文本塊數據的載入與查詢功能。
 也提供建立向量索引的功能。
+
+索引僅使用CPU：查詢都是單一或少量向量，
+複製到GPU的傳輸與同步成本反而高於CPU直接搜尋，
+且省下的VRAM可以留給同一張GPU上的LLM。
 """
 
-import json
+import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Tuple, List, Dict, Any, Optional
 
 import numpy as np
 import faiss
 
+# 批次查詢時FAISS以OpenMP平行處理各查詢向量，明確用滿所有核心
+faiss.omp_set_num_threads(os.cpu_count())
+
 # 設定資料路徑
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
@@ -25,75 +33,98 @@ TEXT_DIR = DATA_DIR / "texts"
 # 每次查詢返回的最相關結果數量
 TOP_K = 15
 
+# HNSW索引參數：M為每個節點的鄰居數，
+# efConstruction/efSearch控制建置與查詢時的探索廣度（越大越準但越慢）
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 40
+HNSW_EF_SEARCH = 16
+
+# 以mmap方式載入索引，讓OS按需載入分頁而非一次讀進RAM，
+# 多worker部署時各行程共享同一份頁面快取
+# 注意：泛用的mmap需要faiss 1.11+的IO_FLAG_MMAP_IFC，
+# 舊式IO_FLAG_MMAP只對IVF倒排列表生效，對HNSW索引是靜默無效；
+# faiss版本過舊或設定環境變數 FAISS_USE_MMAP=0 時改為全量載入
+USE_MMAP = os.environ.get("FAISS_USE_MMAP", "1") != "0"
+
 # 快取全局變數
+# 文本塊以SoA(平行陣列)保存：_sources為來源路徑的object陣列、
+# _contents為內容列表，兩者以位置對應，
+# 不重組成逐塊dict，查詢時就沒有每個結果的雜湊查找與物件開銷
 _index = None
-_chunks = None
-_gpu_resources = None
+_sources = None
+_contents = None
 
+# 載入時預先算好每個來源對應的文字檔完整路徑與顯示名稱，
+# 查詢路徑就不需反覆建立Path物件或呼叫exists()
+_source_paths = None
+_display_names = None
 
-def get_gpu_resources():
-    """獲取GPU資源，如果可用的話"""
-    global _gpu_resources
 
-    # 如果已經初始化過GPU資源，直接返回
-    if _gpu_resources is not None:
-        return _gpu_resources
-
-    try:
-        # 嘗試初始化GPU資源
-        res = faiss.StandardGpuResources()
-        print("成功初始化GPU資源")
-        _gpu_resources = res
-        return res
-    except Exception as e:
-        print(f"無法初始化GPU資源: {e}")
-        return None
-
-
-def load_model() -> Tuple[Optional[Any], Optional[List[Dict[str, Any]]]]:
-    """載入FAISS索引和文本塊資料，支援GPU加速
+def load_model() -> Tuple[Optional[Any], Optional[List[str]]]:
+    """載入FAISS索引和文本塊資料
 
     Returns:
-        tuple: (index, chunks) - FAISS索引和文本塊資料，若載入失敗則返回(None, None)
+        tuple: (index, contents) - FAISS索引和文本塊內容列表，若載入失敗則返回(None, None)
     """
-    global _index, _chunks
+    global _index, _sources, _contents, _source_paths, _display_names
 
     # 如果已經載入，直接返回
-    if _index is not None and _chunks is not None:
-        return _index, _chunks
+    if _index is not None and _contents is not None:
+        return _index, _contents
 
     print("正在載入FAISS索引和文本塊資料...")
 
     index_path = INDEX_DIR / "faiss.index"
-    chunks_path = INDEX_DIR / "chunks.json"
+    chunks_path = INDEX_DIR / "chunks.npz"
 
     if not index_path.exists() or not chunks_path.exists():
         print(f"錯誤：找不到索引文件 ({index_path}) 或文本塊資料 ({chunks_path})")
         return None, None
 
     try:
-        # 載入FAISS索引
-        index = faiss.read_index(str(index_path))
-
-        # 檢查是否有可用的GPU資源
-        gpu_res = get_gpu_resources()
-        if gpu_res is not None:
-            print("檢測到GPU資源，使用GPU加速索引...")
-            # 將索引複製到GPU
-            index = faiss.index_cpu_to_gpu(gpu_res, 0, index)
-
-        # 載入文本塊資料
-        with open(chunks_path, "r", encoding="utf-8") as f:
-            chunks = json.load(f)
+        # 載入FAISS索引（預設使用mmap，冷啟動不需等待整個索引讀入RAM）
+        index = None
+        if USE_MMAP and hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+            try:
+                index = faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+            except Exception as e:
+                print(f"以mmap載入索引失敗，改為全量載入: {e}")
+
+        if index is None:
+            index = faiss.read_index(str(index_path))
+
+        # 設定HNSW索引查詢時的探索廣度
+        # （HNSW索引僅支援CPU，不複製到GPU）
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+
+        # 載入文本塊資料（欄狀npz格式，來源路徑為字典編碼）
+        # npz本來就是欄狀的，直接展開成平行陣列即可
+        data = np.load(chunks_path, allow_pickle=True)
+        source_table = data["source_table"]
+        sources = source_table[data["source_id"]]
+        contents = list(data["content"])
+
+        # 來源路徑只有少數幾百種，一次算好完整路徑與顯示名稱
+        source_paths = {}
+        display_names = {}
+        for source in source_table:
+            txt_path = str(TEXT_DIR / source)
+            p = Path(txt_path)
+            source_paths[source] = txt_path
+            display_names[txt_path] = p.parent.name + "/" + p.name if p.parent.name else p.name
 
         print(f"成功載入索引，包含 {index.ntotal} 個向量")
-        print(f"成功載入文本塊資料，共 {len(chunks)} 個塊")
+        print(f"成功載入文本塊資料，共 {len(contents)} 個塊")
 
         # 快取載入的資源
         _index = index
-        _chunks = chunks
+        _sources = sources
+        _contents = contents
+        _source_paths = source_paths
+        _display_names = display_names
 
-        return index, chunks
+        return index, contents
     except Exception as e:
         print(f"載入索引或文本塊資料時發生錯誤: {e}")
         return None, None
@@ -103,7 +134,8 @@ def create_index(embeddings: np.ndarray) -> bool:
     """為文本塊創建向量索引
 
     Args:
-        embeddings (np.ndarray): 文本塊的嵌入向量，形狀為(n_chunks, vector_dimension)
+        embeddings (np.ndarray): 文本塊的嵌入向量，形狀為(n_chunks, vector_dimension)，
+            應已做過L2標準化，使內積等於餘弦相似度
 
     Returns:
         bool: 索引創建是否成功
@@ -111,80 +143,122 @@ def create_index(embeddings: np.ndarray) -> bool:
     # 確保索引目錄存在
     INDEX_DIR.mkdir(exist_ok=True, parents=True)
 
-    # 將嵌入轉換為numpy數組並標準化
-    embeddings = np.array(embeddings).astype("float32")
-    faiss.normalize_L2(embeddings)
+    # 確保為連續的float32陣列（標準化已在建置流程完成）
+    # ascontiguousarray在輸入已符合時不做任何複製，直接使用呼叫端的緩衝區
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    assert embeddings.flags.c_contiguous
 
     # 建立FAISS索引
+    # HNSW圖遍歷搭配int8純量量化：向量儲存縮為FP32的四分之一，
+    # 記憶體頻寬受限的距離計算因快取命中率提升而加快
+    # 注意：FAISS的HNSW索引僅支援CPU
     print("建立FAISS索引...")
     vector_dimension = embeddings.shape[1]
-    index = faiss.IndexFlatIP(vector_dimension)
-
-    # 檢查是否有可用的GPU資源
-    gpu_res = get_gpu_resources()
-    if gpu_res is not None:
-        print("檢測到GPU資源，使用GPU加速索引...")
-        index = faiss.index_cpu_to_gpu(gpu_res, 0, index)
+    index = faiss.IndexHNSWSQ(vector_dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
 
-    # 添加向量到索引
+    # 量化器需要先以資料訓練每個維度的數值範圍，再添加向量建圖
+    index.train(embeddings)
     index.add(embeddings)
 
     # 保存索引
-    if isinstance(index, faiss.GpuIndexFlat):
-        print("將索引從GPU移回CPU以保存...")
-        index = faiss.index_gpu_to_cpu(index)
-
     print(f"保存索引到 {INDEX_DIR / 'faiss.index'}")
     faiss.write_index(index, str(INDEX_DIR / "faiss.index"))
 
     return True
 
 
-def query_index(query_vector: np.ndarray, top_k: int = TOP_K) -> List[Dict[str, Any]]:
-    """使用查詢向量檢索最相關的文本
+def warmup():
+    """預熱索引，讓首次查詢的延遲與熱查詢一致
+
+    mmap載入的索引要到實際查詢才會觸發頁面載入，
+    先循序讀取索引檔案填入OS頁面快取，再執行一次虛擬查詢。
+    """
+    index, contents = load_model()
+    if index is None:
+        return
+
+    # 循序讀取索引檔案，填入OS頁面快取
+    try:
+        with open(INDEX_DIR / "faiss.index", "rb") as f:
+            while f.read(1 << 20):
+                pass
+    except OSError as e:
+        print(f"預熱索引檔案時發生錯誤: {e}")
+
+    # 虛擬查詢觸發搜尋路徑需要的頁面與內部初始化
+    try:
+        query_index(np.ones((1, index.d), dtype=np.float32))
+    except Exception as e:
+        print(f"預熱查詢時發生錯誤: {e}")
+
+
+# 每個來源文件最多讀入的內容長度
+CONTENT_MAX_CHARS = 4500
+
+
+@lru_cache(maxsize=4096)
+def read_text(txt_path: str) -> str:
+    """讀取來源文字檔內容（限制長度），快取重複命中的檔案
+
+    直接以read(n)讀取需要的長度，不整檔讀入再切片。
+    """
+    with open(txt_path, "r", encoding="utf-8") as f:
+        return f.read(CONTENT_MAX_CHARS)
+
+
+def _build_results(distances: np.ndarray, indices: np.ndarray) -> List[Dict[str, Any]]:
+    """將單一查詢的搜尋結果轉換為包含來源、相似度和檔案路徑的列表
+
+    這裡不讀取檔案內容：部分結果會被呼叫端以相似度門檻過濾掉，
+    內容由需要的一方再以read_text讀取，被過濾的檔案完全不碰磁碟。
+    """
+    # 建立來源路徑到相似度的映射（路徑已在載入時算好）
+    # 邊界檢查與來源取值都以NumPy一次完成，不走逐元素的Python迴圈；
+    # 同一來源多次命中時由後者覆寫，與原本的逐筆寫入語意相同
+    mask = (indices >= 0) & (indices < len(_sources))
+    sources = _sources[indices[mask]]
+    similarities = distances[mask].tolist()
+    similarity_map = {_source_paths[source]: similarity for source, similarity in zip(sources, similarities)}
+
+    return [
+        {"file": _display_names[txt_path], "path": txt_path, "similarity": similarity}
+        for txt_path, similarity in similarity_map.items()
+    ]
+
+
+def query_index_batch(query_vectors: np.ndarray, top_k: int = TOP_K) -> List[List[Dict[str, Any]]]:
+    """使用多個查詢向量一次檢索最相關的文本
+
+    單次search呼叫讓FAISS以OpenMP和分塊矩陣運算平行處理所有查詢，
+    比逐一查詢更有效率。
 
     Args:
-        query_vector (np.ndarray): 查詢的向量，形狀為(1, 向量維度)
-        top_k (int): 返回最相關的結果數量，預設為TOP_K
+        query_vectors (np.ndarray): 查詢的向量，形狀為(查詢數, 向量維度)
+        top_k (int): 每個查詢返回最相關的結果數量，預設為TOP_K
 
     Returns:
-        List[Dict[str, Any]]: 包含內容、來源和相似度的結果列表
+        List[List[Dict[str, Any]]]: 每個查詢各一份包含來源、相似度和檔案路徑的結果列表
     """
-    index, chunks = load_model()
-    if index is None or chunks is None:
+    index, contents = load_model()
+    if index is None or contents is None:
         raise RuntimeError("索引載入失敗，無法執行搜尋")
 
-    # 標準化查詢向量，在索引中搜尋
-    faiss.normalize_L2(query_vector)
-    distances, indices = index.search(query_vector, top_k)
-
-    # 建立來源路徑到相似度的映射
-    similarity_map = {}
-    for i, idx in enumerate(indices[0]):
-        if idx < 0 or idx >= len(chunks):
-            continue
+    # 在索引中一次搜尋所有查詢
+    # （編碼器輸出已做L2標準化，這裡不需再標準化）
+    distances, indices = index.search(query_vectors, top_k)
 
-        source = chunks[idx]["source"]
-        similarity = float(distances[0][i])
-        txt_path = str(TEXT_DIR / source)
+    return [_build_results(distances[i], indices[i]) for i in range(len(query_vectors))]
 
-        # 只記錄檔案存在的來源
-        if Path(txt_path).exists():
-            similarity_map[txt_path] = similarity
 
-    # 處理文本檔案並建立最終結果
-    final_results = []
-    for txt_path, similarity in similarity_map.items():
-        try:
-            with open(txt_path, "r", encoding="utf-8") as f:
-                content = f.read()
-
-            p = Path(txt_path)
-            name = str(p.parent.name + "/" + p.name) if p.parent.name else p.name
-            content = str(content)[:4500]  # 限制內容長度
-            final_results.append({"file": name, "content": content, "similarity": similarity})
+def query_index(query_vector: np.ndarray, top_k: int = TOP_K) -> List[Dict[str, Any]]:
+    """使用查詢向量檢索最相關的文本
 
-        except Exception as e:
-            print(f"處理HTML檔案 {txt_path} 時出錯: {e}")
+    Args:
+        query_vector (np.ndarray): 查詢的向量，形狀為(1, 向量維度)
+        top_k (int): 返回最相關的結果數量，預設為TOP_K
 
-    return final_results
+    Returns:
+        List[Dict[str, Any]]: 包含來源、相似度和檔案路徑的結果列表
+    """
+    return query_index_batch(query_vector, top_k)[0]
@@ -7,8 +7,9 @@ model_ollama.py - Ollama API 串接模組
 此腳本提供與 Ollama API 的通信功能，支援流式輸出和錯誤處理。
 """
 
-import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Iterator, Optional
 
 # 設定 Ollama 相關參數
@@ -16,6 +17,11 @@ OLLAMA_API_URL = "http://ollama:11434/api/generate"
 OLLAMA_MODEL = "gemma3:4b-it-q8_0"  # 默認使用的模型名稱
 OLLAMA_CONTEXT_LENGTH = 8192 * 2  # Ollama模型的上下文長度限制
 
+# 共用的Session以keep-alive重用對Ollama的TCP連線，
+# 省去每次請求重新建立連線的往返延遲
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 
 def query_ollama(prompt: str, model: str = OLLAMA_MODEL) -> Optional[str]:
     """
@@ -23,7 +29,7 @@ def query_ollama(prompt: str, model: str = OLLAMA_MODEL) -> Optional[str]:
     """
     try:
         payload = {"model": model, "prompt": prompt, "stream": False, "options": {"num_ctx": OLLAMA_CONTEXT_LENGTH}}
-        response = requests.post(OLLAMA_API_URL, json=payload)
+        response = _SESSION.post(OLLAMA_API_URL, json=payload)
 
         if response.status_code != 200:
             error_msg = f"Ollama API請求失敗: HTTP {response.status_code} - {response.text}"
@@ -45,7 +51,7 @@ def query_ollama_stream(prompt: str, model: str = OLLAMA_MODEL) -> Iterator[str]
     """
     try:
         payload = {"model": model, "prompt": prompt, "stream": True, "options": {"num_ctx": OLLAMA_CONTEXT_LENGTH}}
-        response = requests.post(OLLAMA_API_URL, json=payload, stream=True)
+        response = _SESSION.post(OLLAMA_API_URL, json=payload, stream=True)
 
         if response.status_code != 200:
             error_msg = f"Ollama API請求失敗: HTTP {response.status_code} - {response.text}"
@@ -53,10 +59,12 @@ def query_ollama_stream(prompt: str, model: str = OLLAMA_MODEL) -> Iterator[str]
             yield f"處理您的問題時發生錯誤: {error_msg}"
             return
 
+        # Ollama每個token發一行JSON，orjson直接吃bytes解析，
+        # 不需先decode成str再用純Python解析器處理
         for line in response.iter_lines():
             try:
-                data = json.loads(line.decode("utf-8"))
-            except json.JSONDecodeError as e:
+                data = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
                 print(f"解析JSON回應時發生錯誤: {e}")
                 continue
 
@@ -13,6 +13,8 @@ from pathlib import Path
 from typing import List, Dict, Any
 import textwrap
 
+import numpy as np
+
 # 導入專用模型加載模塊
 from scripts import model_embedding
 from scripts import model_faiss
@@ -23,35 +25,72 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 INDEX_DIR = DATA_DIR / "index"
 
+# 提示詞模板在模組載入時dedent一次，請求路徑只需format填入變動的部分
+_KEYWORDS_TEMPLATE = textwrap.dedent("""\
+    你是一位專業的關鍵字提取專家，負責從用戶的問題中提取與 Blender 3D 軟體相關的重要關鍵字與概念。
 
-def generate_keywords(question: str, model_name: str = model_ollama.OLLAMA_MODEL) -> str:
-    """使用LLM從問題中生成關鍵字列表"""
-    # 構建生成關鍵字的prompt
-    prompt = textwrap.dedent(f"""\
-        你是一位專業的關鍵字提取專家，負責從用戶的問題中提取與 Blender 3D 軟體相關的重要關鍵字與概念。
+    請根據問題內容，分析其意圖，並提取 10～20 個關鍵字。這些關鍵字可以是：
+    1. 使用到的功能或技術（如：節點、布林、粒子系統）
+    2. 使用到的渲染引擎（如：Cycles、Eevee）
+    3. 隱含的語意概念（例如：若問題提到「寫實」，請包含「Cycles」；若提到「快速渲染」，可包含「Eevee」）
+
+    僅輸出關鍵字，以「英文半形逗號」分隔，且請務必不要換行或添加多餘說明，這樣我才能用 `keywords = [kw.strip() for kw in response.split(",")]`進行分析。
+
+    範例：
+    問題：如何在Blender中製作寫實的水材質？
+    回答：water material,shader,shader nodes,realistic material,Cycles,refraction,transparency,fresnel,IOR,PBR,BSDF,reflection,caustics,subsurface scattering,render engine,node editor,glass shader,lighting,wet surface,material preview
+
+    問題：我要快速預覽玻璃材質效果
+    回答：glass material,Eevee,preview,shader,simple lighting,transparency,viewport shading,material preview,node editor,real-time rendering,refractive shader,BSDF,screen space reflections,alpha blend,render engine,glass BSDF,roughness,IOR,shader nodes,viewport performance
+
+    問題：用表格展示python bpy常用工具
+    回答：Python,bpy,API,Blender scripting,Blender addon,table display,UI panel,operator,property,layout,script editor,automation,developer tools,object manipulation,mesh editing,data access,custom tool,addon development,interface,code example
 
-        請根據問題內容，分析其意圖，並提取 10～20 個關鍵字。這些關鍵字可以是：
-        1. 使用到的功能或技術（如：節點、布林、粒子系統）
-        2. 使用到的渲染引擎（如：Cycles、Eevee）
-        3. 隱含的語意概念（例如：若問題提到「寫實」，請包含「Cycles」；若提到「快速渲染」，可包含「Eevee」）
+    問題：{question}
+    關鍵字：
 
-        僅輸出關鍵字，以「英文半形逗號」分隔，且請務必不要換行或添加多餘說明，這樣我才能用 `keywords = [kw.strip() for kw in response.split(",")]`進行分析。
+    格式務必與上述範例完全相同，否則將導致解析失敗。
+""")
 
-        範例：
-        問題：如何在Blender中製作寫實的水材質？
-        回答：water material,shader,shader nodes,realistic material,Cycles,refraction,transparency,fresnel,IOR,PBR,BSDF,reflection,caustics,subsurface scattering,render engine,node editor,glass shader,lighting,wet surface,material preview
+_CONTEXT_TEMPLATE = textwrap.dedent("""\
+    [文件 {file}]
+    與該問題的相關性: {similarity:.2f}
+    內容: {content}
+""")
 
-        問題：我要快速預覽玻璃材質效果
-        回答：glass material,Eevee,preview,shader,simple lighting,transparency,viewport shading,material preview,node editor,real-time rendering,refractive shader,BSDF,screen space reflections,alpha blend,render engine,glass BSDF,roughness,IOR,shader nodes,viewport performance
+_PROMPT_TEMPLATE = textwrap.dedent("""\
+    你是 Blender 官方手冊的專業導覽員，負責協助繁體中文使用者查詢 **Blender 4.2** 版功能與操作說明。
 
-        問題：用表格展示python bpy常用工具
-        回答：Python,bpy,API,Blender scripting,Blender addon,table display,UI panel,operator,property,layout,script editor,automation,developer tools,object manipulation,mesh editing,data access,custom tool,addon development,interface,code example
+    請注意以下規則：
+    - 必須**全程使用正體中文**回答，**不可混用簡體字**。
+    - 回答必須**僅根據提供的參考文件內容**，**不得引用未提供的外部資訊**。
+    - 如果參考文件中**無法找到足夠資訊**，請明確說明「**無法回答**」，**禁止推測或自行編造內容**。
+    - 如果問題與 Blender 無關，請禮貌地回應：「此問題超出 Blender 手冊的範圍，無法回答。」
 
-        問題：{question}
-        關鍵字：
+    系統根據問題找到的參考文件：
+    {context_texts_joined}
 
-        格式務必與上述範例完全相同，否則將導致解析失敗。
-    """)
+    特別指引：
+    - 請綜合所有參考文件內容進行回答，**避免僅依賴單一文件**，除非只有一份資料可用。
+    - 請根據現有文件內容，主動列出2～3個具體的後續提問範例（例如：「如何設定剛體物理效果？」「如何使用Subdivision Surface細分物件？」），
+      這些範例必須與參考文件中提及的功能相關，不得超出文件範圍自行假設。
+    - 若參考文件內容不足以提出2～3個具體提問，請酌情列出可行範例或略過此步驟。
+
+    最後請保持回答的：
+    - 條理清晰
+    - 使用 Blender 專有名詞時，儘量保留原文並加上中文說明（例如：「Subdivision Surface（細分曲面）」）
+
+    使用者的問題是：
+    {query}
+
+    請以專業且親切的態度，給出最適切且詳盡的回答。
+""")
+
+
+def generate_keywords(question: str, model_name: str = model_ollama.OLLAMA_MODEL) -> str:
+    """使用LLM從問題中生成關鍵字列表"""
+    # 構建生成關鍵字的prompt
+    prompt = _KEYWORDS_TEMPLATE.format(question=question)
 
     # 呼叫LLM生成關鍵字
     try:
@@ -63,11 +102,32 @@ def generate_keywords(question: str, model_name: str = model_ollama.OLLAMA_MODEL
         return []
 
 
-def retrieve_relevant_texts(query: str) -> List[Dict[str, Any]]:
-    """使用查詢來檢索最相關的文本"""
+# 每個關鍵字各自返回的結果數量
+TOP_K_PER_KEYWORD = 5
+
+
+def retrieve_relevant_texts(keywords: List[str]) -> List[Dict[str, Any]]:
+    """使用關鍵字列表批次檢索最相關的文本
+
+    所有關鍵字一次編碼、一次搜尋：批次讓編碼器與FAISS
+    以矩陣運算平行處理，且每個關鍵字保有自己的語意向量，
+    不會像整串合併編碼那樣被平均稀釋。
+    同一來源文件被多個關鍵字命中時，取其中最高的相似度。
+    """
     try:
-        query_vector = model_embedding.encode_text([query])[0].astype("float32").reshape(1, -1)
-        results = model_faiss.query_index(query_vector)
+        kw_matrix = np.ascontiguousarray(model_embedding.encode_text(keywords), dtype=np.float32)
+        results_per_keyword = model_faiss.query_index_batch(kw_matrix, top_k=TOP_K_PER_KEYWORD)
+
+        # 以來源檔案的完整路徑為鍵合併，相似度取各關鍵字中的最大值
+        # （"file"只是最後兩層的顯示名稱，不同文件可能同名）
+        merged: Dict[str, Dict[str, Any]] = {}
+        for keyword_results in results_per_keyword:
+            for result in keyword_results:
+                existing = merged.get(result["path"])
+                if existing is None or result["similarity"] > existing["similarity"]:
+                    merged[result["path"]] = result
+
+        results = sorted(merged.values(), key=lambda r: r["similarity"], reverse=True)
         print("檢索到的相關文本:")
         for i, result in enumerate(results):
             print(f"結果 {i + 1}: 來源: {result['file']}, 相似度: {result['similarity']}")
@@ -84,43 +144,20 @@ def build_prompt(query: str, texts: List[Dict[str, Any]]) -> str:
         if text["similarity"] < 0.4:
             continue
 
+        # 通過相似度門檻才讀取檔案內容，被過濾的結果不做任何IO
+        try:
+            content = model_faiss.read_text(text["path"])
+        except Exception as e:
+            print(f"讀取文件 {text['path']} 時發生錯誤: {e}")
+            continue
+
         # 添加來源和內容到上下文
-        context_text = textwrap.dedent(f"""\
-            [文件 {text["file"]}]
-            與該問題的相關性: {text["similarity"]:.2f}
-            內容: {text["content"]}
-        """)
+        context_text = _CONTEXT_TEMPLATE.format(file=text["file"], similarity=text["similarity"], content=content)
         context_texts.append(context_text)
 
     # 組合完整的prompt
     context_texts_joined = "\n\n".join(context_texts)
-    prompt = textwrap.dedent(f"""\
-        你是 Blender 官方手冊的專業導覽員，負責協助繁體中文使用者查詢 **Blender 4.2** 版功能與操作說明。
-
-        請注意以下規則：
-        - 必須**全程使用正體中文**回答，**不可混用簡體字**。
-        - 回答必須**僅根據提供的參考文件內容**，**不得引用未提供的外部資訊**。
-        - 如果參考文件中**無法找到足夠資訊**，請明確說明「**無法回答**」，**禁止推測或自行編造內容**。
-        - 如果問題與 Blender 無關，請禮貌地回應：「此問題超出 Blender 手冊的範圍，無法回答。」
-
-        系統根據問題找到的參考文件：
-        {context_texts_joined}
-
-        特別指引：
-        - 請綜合所有參考文件內容進行回答，**避免僅依賴單一文件**，除非只有一份資料可用。
-        - 請根據現有文件內容，主動列出2～3個具體的後續提問範例（例如：「如何設定剛體物理效果？」「如何使用Subdivision Surface細分物件？」），
-          這些範例必須與參考文件中提及的功能相關，不得超出文件範圍自行假設。
-        - 若參考文件內容不足以提出2～3個具體提問，請酌情列出可行範例或略過此步驟。
-
-        最後請保持回答的：
-        - 條理清晰
-        - 使用 Blender 專有名詞時，儘量保留原文並加上中文說明（例如：「Subdivision Surface（細分曲面）」）
-
-        使用者的問題是：
-        {query}
-
-        請以專業且親切的態度，給出最適切且詳盡的回答。
-    """)
+    prompt = _PROMPT_TEMPLATE.format(context_texts_joined=context_texts_joined, query=query)
     return prompt
 
 
@@ -129,7 +166,13 @@ def process_query(question: str, model_name: str = model_ollama.OLLAMA_MODEL):
     try:
         # 檢索相關文本塊
         print(f"正在處理問題: '{question}'")
-        keywords = generate_keywords(question, model_name)
+        response = generate_keywords(question, model_name)
+        keywords = [kw.strip() for kw in response.split(",") if kw.strip()] if response else []
+
+        # 關鍵字生成失敗時退回以原始問題檢索
+        if not keywords:
+            keywords = [question]
+
         relevant_texts = retrieve_relevant_texts(keywords)
 
         if not relevant_texts: